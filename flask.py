@@ -11,6 +11,7 @@
 """
 from __future__ import with_statement
 import os
+import re
 import sys
 
 from threading import local
@@ -18,7 +19,7 @@ from jinja2 import Environment, PackageLoader, FileSystemLoader
 from werkzeug import Request as RequestBase, Response as ResponseBase, \
      LocalStack, LocalProxy, create_environ, cached_property, \
      SharedDataMiddleware
-from werkzeug.routing import Map, Rule
+from werkzeug.routing import Map, Rule, UnicodeConverter
 from werkzeug.exceptions import HTTPException, InternalServerError
 from werkzeug.contrib.securecookie import SecureCookie
 
@@ -36,6 +37,9 @@ try:
 except (ImportError, AttributeError):
     pkg_resources = None
 
+# marks the session of a request context that was not loaded yet
+_missing = object()
+
 
 class Request(RequestBase):
     """
@@ -73,16 +77,55 @@ class _RequestContext(object):
     _RequestContext利用__enter__与__exit__魔术方法可以与with配合提供上下文管理器，进入请求上下文环境时，
     将当前上下文环境推入上下文环境栈_request_ctx_stack中，
     当离开当前上下文环境时，从上下文环境栈_request_ctx_stack中移除
+
+    请求结束后上下文对象会被放回application的_ctx_pool中，下次请求通过_reinit()重新初始化后复用
+
+    session在第一次访问时才通过open_session()加载，没有用到session的请求不需要校验和解析cookie
     """
+    __slots__ = ('app', 'url_adapter', 'request', '_session', 'g', 'flashes')
 
     def __init__(self, app, environ):
         self.app = app
-        self.url_adapter = app.url_map.bind_to_environ(environ)
+        self._reinit(environ)
+
+    def _reinit(self, environ):
+        app = self.app
+        # 与url_map.bind_to_environ(environ)相同，直接从environ中取出需要的值调用bind()
+        server_name = environ.get('HTTP_HOST')
+        if server_name is None:
+            server_name = environ['SERVER_NAME']
+            if (environ['wsgi.url_scheme'], environ['SERVER_PORT']) not \
+               in (('https', '443'), ('http', '80')):
+                server_name += ':' + environ['SERVER_PORT']
+        self.url_adapter = app.url_map.bind(server_name,
+                                            environ.get('SCRIPT_NAME'), None,
+                                            environ['wsgi.url_scheme'],
+                                            environ['REQUEST_METHOD'],
+                                            environ.get('PATH_INFO'))
         self.request = app.request_class(environ)
-        self.session = app.open_session(self.request)
+        self._session = _missing
         self.g = _RequestGlobals()
         self.flashes = None
 
+    def _release(self):
+        """Drops the references to the request data so that a pooled
+        context does not keep them alive.
+        """
+        self.url_adapter = self.request = self._session = self.g = \
+            self.flashes = None
+
+    @property
+    def session(self):
+        """The session of the request, opened on first access."""
+        rv = self._session
+        if rv is _missing:
+            self._session = rv = self.app.open_session(self.request)
+        return rv
+
+    @session.setter
+    def session(self, value):
+        self._session = value
+
     def __enter__(self):
         _request_ctx_stack.push(self)
 
@@ -94,6 +137,170 @@ class _RequestContext(object):
             _request_ctx_stack.pop()
 
 
+# matches rule segments that consist of a single unicode (string) variable
+# without arguments such as ``<name>`` or ``<string:name>``
+_simple_variable_re = re.compile(r'^<(?:(string):)?([a-zA-Z_][a-zA-Z0-9_]*)>$')
+
+
+class _URLMap(Map):
+    """A :class:`~werkzeug.routing.Map` that counts how often rules were
+    added to it so that the :class:`_URLTrie` can tell when it's stale.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.version = 0
+        Map.__init__(self, *args, **kwargs)
+
+    def add(self, rulefactory):
+        Map.add(self, rulefactory)
+        self.version += 1
+
+
+class _URLTrieNode(object):
+    """A node of the :class:`_URLTrie`."""
+    __slots__ = ('static', 'variable', 'rules')
+
+    def __init__(self):
+        self.static = {}
+        self.variable = None
+        self.rules = []
+
+
+class _URLTrie(object):
+    """
+    按路径分段构建的路由前缀树，用于加速url_map的匹配
+    werkzeug的MapAdapter.match()会按顺序对所有的Rule依次进行正则匹配，路由越多越慢，
+    前缀树只需要按照路径的分段逐层查找即可
+
+    只有由静态分段和不带参数的字符串变量组成的Rule会放入前缀树中，其它的Rule(复杂的converter、
+    defaults、redirect_to、子域名等)交给werkzeug处理。匹配结果和werkzeug保持一致：
+    在url_map排序后的位置最靠前的Rule胜出，如果命中结果之前存在前缀树无法表示的Rule，
+    或者需要重定向补全末尾的斜杠，match()返回None，由调用方回退到url_adapter.match()
+    """
+
+    def __init__(self, url_map):
+        url_map.update()
+        self.map = url_map
+        self.subdomain = url_map.default_subdomain
+        self.root = _URLTrieNode()
+        rules = list(url_map.iter_rules())
+        #: the version of the map and the converters used for simple
+        #: variables when the trie was built, see :meth:`is_stale`.
+        self.version = url_map.version
+        self.converters = (url_map.converters.get('default'),
+                           url_map.converters.get('string'))
+        #: the sort position of the first rule the trie cannot represent.
+        #: matches after this position might be shadowed by that rule.
+        self.limit = len(rules)
+        simple_converters = set(name for name, converter
+                                in zip(('default', 'string'),
+                                       self.converters)
+                                if converter is UnicodeConverter)
+        # redirect_defaults may redirect any rule of an endpoint that
+        # has a rule with defaults, leave those to werkzeug.
+        defaults_endpoints = set(rule.endpoint for rule in rules
+                                 if rule.defaults is not None)
+        for position, rule in enumerate(rules):
+            if rule.build_only:
+                continue
+            segments = None
+            if rule.endpoint not in defaults_endpoints:
+                segments = self._split_rule(rule, simple_converters)
+            if segments is None:
+                self.limit = min(self.limit, position)
+                continue
+            node = self.root
+            names = []
+            for is_variable, value in segments:
+                if is_variable:
+                    names.append(value)
+                    if node.variable is None:
+                        node.variable = _URLTrieNode()
+                    node = node.variable
+                else:
+                    node = node.static.setdefault(value, _URLTrieNode())
+            node.rules.append((position, rule, tuple(names)))
+
+    def _split_rule(self, rule, simple_converters):
+        """Splits the rule into ``(is_variable, value)`` segments or returns
+        `None` if the rule cannot be represented by the trie.
+        """
+        if rule.subdomain != self.subdomain or not rule.strict_slashes or \
+           rule.defaults is not None or rule.redirect_to is not None or \
+           '//' in rule.rule:
+            return None
+        segments = []
+        for part in rule.rule[1:].split('/'):
+            if '<' not in part and '>' not in part:
+                segments.append((False, part))
+                continue
+            match = _simple_variable_re.match(part)
+            if match is None or \
+               (match.group(1) or 'default') not in simple_converters:
+                return None
+            segments.append((True, match.group(2)))
+        return segments
+
+    def is_stale(self, url_map):
+        """Checks if the trie was built for another map or if rules were
+        added to the map or its string converters replaced since.
+        """
+        converters = url_map.converters
+        return url_map is not self.map or \
+            url_map.version != self.version or \
+            converters.get('default') is not self.converters[0] or \
+            converters.get('string') is not self.converters[1]
+
+    def match(self, url_adapter):
+        """Matches the path of the url adapter.  Returns ``(endpoint,
+        view_args)`` like :meth:`~werkzeug.routing.MapAdapter.match` or
+        `None` if werkzeug has to do the matching.
+        """
+        if url_adapter.map is not self.map or \
+           url_adapter.subdomain != self.subdomain:
+            return None
+        path_info = url_adapter.path_info
+        if not isinstance(path_info, unicode):
+            path_info = path_info.decode(self.map.charset, 'ignore')
+        method = url_adapter.default_method.upper()
+        best = self._search(self.root, path_info.lstrip(u'/').split(u'/'),
+                            0, [], method, None)
+        if best is None or best[0] >= self.limit or best[1] is None:
+            return None
+        return best[1].endpoint, best[2]
+
+    def _search(self, node, segments, index, values, method, best):
+        """Walks the trie and returns the best ``(position, rule, view_args)``
+        match.  A rule of `None` means that werkzeug would redirect to the
+        url with a trailing slash.
+        """
+        if index == len(segments):
+            for position, rule, names in node.rules:
+                if best is not None and position >= best[0]:
+                    break
+                if rule.methods is None or method in rule.methods:
+                    best = (position, rule, dict(zip(names, values)))
+                    break
+            # a rule with a trailing slash matches regardless of the method
+            # and werkzeug will redirect to it
+            branch = node.static.get(u'')
+            if branch is not None and branch.rules and \
+               (best is None or branch.rules[0][0] < best[0]):
+                best = (branch.rules[0][0], None, None)
+            return best
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            best = self._search(child, segments, index + 1, values,
+                                method, best)
+        if segment and node.variable is not None:
+            values.append(segment)
+            best = self._search(node.variable, segments, index + 1, values,
+                                method, best)
+            values.pop()
+        return best
+
+
 def url_for(endpoint, **values):
     """Generates a URL to the given endpoint with the method provided.
 
@@ -110,7 +317,14 @@ def flash(message):
 
     :param message: the message to be flashed.
     """
-    session['_flashes'] = (session.get('_flashes', [])) + [message]
+    reqctx = _request_ctx_stack.top
+    flashes = reqctx.session.get('_flashes')
+    if flashes is None:
+        reqctx.session['_flashes'] = [message]
+    else:
+        # 直接在原列表上追加，需要手动标记session已修改
+        flashes.append(message)
+        reqctx.session.modified = True
 
 
 def get_flashed_messages():
@@ -118,10 +332,10 @@ def get_flashed_messages():
     Further calls in the same request to the function will return
     the same messages.
     """
-    flashes = _request_ctx_stack.top.flashes
+    reqctx = _request_ctx_stack.top
+    flashes = reqctx.flashes
     if flashes is None:
-        _request_ctx_stack.top.flashes = flashes = \
-            session.pop('_flashes', [])
+        reqctx.flashes = flashes = reqctx.session.pop('_flashes', [])
     return flashes
 
 
@@ -133,8 +347,9 @@ def render_template(template_name, **context):
     :param context: the variables that should be available in the
                     context of the template.
     """
-    current_app.update_template_context(context)
-    return current_app.jinja_env.get_template(template_name).render(context)
+    app = _request_ctx_stack.top.app
+    app.update_template_context(context)
+    return app.jinja_env.get_template(template_name).render(context)
 
 
 def render_template_string(source, **context):
@@ -146,20 +361,22 @@ def render_template_string(source, **context):
     :param context: the variables that should be available in the
                     context of the template.
     """
-    current_app.update_template_context(context)
-    return current_app.jinja_env.from_string(source).render(context)
+    app = _request_ctx_stack.top.app
+    app.update_template_context(context)
+    return app.jinja_env.from_string(source).render(context)
 
 
-def _default_template_ctx_processor():
+def _default_template_ctx_processor(context):
     """Default template context processor.  Injects `request`,
-    `session` and `g`.
+    `session` and `g` into the context in place.
     """
     reqctx = _request_ctx_stack.top
-    return dict(
-        request=reqctx.request,
-        session=reqctx.session,
-        g=reqctx.g
-    )
+    context['request'] = reqctx.request
+    context['session'] = reqctx.session
+    context['g'] = reqctx.g
+
+
+_default_template_ctx_processor.__flask_inplace__ = True
 
 
 def _get_package_path(name):
@@ -217,6 +434,9 @@ class Flask(object):
         extensions=['jinja2.ext.autoescape', 'jinja2.ext.with_']
     )
 
+    # the maximum number of finished request contexts kept for reuse
+    _ctx_pool_size = 8
+
     def __init__(self, package_name):
         #: the debug flag.  Set this to `True` to enable debugging of
         #: the application.  In debug mode the debugger will kick in
@@ -262,13 +482,46 @@ class Flask(object):
 
         #: a list of functions that are called without arguments
         #: to populate the template context.  Each returns a dictionary
-        #: that the template context is updated with.
+        #: that the template context is updated with.  Functions with a
+        #: true `__flask_inplace__` attribute are instead called with the
+        #: context dictionary and update it in place.
         #: To register a function here, use the :meth:`context_processor`
         #: decorator.
         self.template_context_processors = [_default_template_ctx_processor]
 
-        self.url_map = Map()
-
+        # the default secure cookie only has to be saved if the request
+        # used it.  sessions of subclasses that override :meth:`open_session`
+        # or :meth:`save_session` are always opened and saved.
+        cls = type(self)
+        self._custom_sessions = \
+            cls.open_session.im_func is not Flask.open_session.im_func or \
+            cls.save_session.im_func is not Flask.save_session.im_func
+
+        # requests are only handled without :meth:`preprocess_request` and
+        # :meth:`process_response` if a subclass did not override them or
+        # the session handling they rely on
+        self._custom_request_hooks = \
+            self._custom_sessions or \
+            cls.preprocess_request.im_func is not \
+            Flask.preprocess_request.im_func or \
+            cls.process_response.im_func is not \
+            Flask.process_response.im_func
+
+        # request contexts of finished requests that :meth:`request_context`
+        # hands out again.  list.pop() and list.append() are atomic so the
+        # pool can be shared between threads.
+        self._ctx_pool = []
+
+        self.url_map = _URLMap()
+
+        # the :class:`_URLTrie` used to speed up matching.  It's built
+        # on the first request and rebuilt when the url map changes.
+        self._url_trie = None
+
+        # the WSGI application serving the static files.  Requests for
+        # missing files are passed on to :meth:`_dispatch_wsgi`.
+        self._static_app = None
+        self._static_path = self.static_path
         if self.static_path is not None:
             self.url_map.add(Rule(self.static_path + '/<filename>',
                                   build_only=True, endpoint='static'))
@@ -276,7 +529,7 @@ class Flask(object):
                 target = (self.package_name, 'static')
             else:
                 target = os.path.join(self.root_path, 'static')
-            self.wsgi_app = SharedDataMiddleware(self.wsgi_app, {
+            self._static_app = SharedDataMiddleware(self._dispatch_wsgi, {
                 self.static_path: target
             })
 
@@ -307,9 +560,12 @@ class Flask(object):
         :param context: the context as a dictionary that is updated in place
                         to add extra variables.
         """
-        reqctx = _request_ctx_stack.top
         for func in self.template_context_processors:
-            context.update(func())
+            # 标记了__flask_inplace__的处理函数直接修改context，避免创建临时的dict
+            if getattr(func, '__flask_inplace__', False):
+                func(context)
+            else:
+                context.update(func())
 
     def run(self, host='localhost', port=5000, **options):
         """
@@ -380,6 +636,9 @@ class Flask(object):
 
         可以看到看到需要将endpoint和methods构建Rule，然后调用Map的add方法，即可保存路由映射关系
         """
+        # endpoint会作为view_functions的key，intern之后字典查找只需要比较指针
+        if isinstance(endpoint, str):
+            endpoint = intern(endpoint)
         options['endpoint'] = endpoint
         options.setdefault('methods', ('GET',))
         self.url_map.add(Rule(rule, **options))
@@ -431,8 +690,19 @@ class Flask(object):
         从请求栈_request_ctx_stack取出栈顶的请求，可以认为是本次的网络请求，利用请求的url和参数，和路由注册中保存的数据进行匹配，
         即可得到endpoint和请求参数
         """
-        rv = _request_ctx_stack.top.url_adapter.match()
-        request.endpoint, request.view_args = rv
+        reqctx = _request_ctx_stack.top
+        rv = None
+        url_map = self.url_map
+        # 只有_URLMap能感知规则的变化，替换成其它Map时直接交给werkzeug匹配
+        if isinstance(url_map, _URLMap):
+            url_trie = self._url_trie
+            if url_trie is None or url_trie.is_stale(url_map):
+                self._url_trie = url_trie = _URLTrie(url_map)
+            rv = url_trie.match(reqctx.url_adapter)
+        # 前缀树无法确定匹配结果时，交给werkzeug进行匹配
+        if rv is None:
+            rv = reqctx.url_adapter.match()
+        reqctx.request.endpoint, reqctx.request.view_args = rv
         return rv
 
     def dispatch_request(self):
@@ -444,14 +714,20 @@ class Flask(object):
             endpoint, values = self.match_request()
             return self.view_functions[endpoint](**values)
         except HTTPException, e:
-            # 处理失败时可以调用注册的错误处理函数进行处理
-            handler = self.error_handlers.get(e.code)
+            # 处理失败时可以调用注册的错误处理函数进行处理，没有注册任何错误处理函数时直接返回
+            error_handlers = self.error_handlers
+            if not error_handlers:
+                return e
+            handler = error_handlers.get(e.code)
             if handler is None:
                 return e
             return handler(e)
         except Exception, e:
-            handler = self.error_handlers.get(500)
-            if self.debug or handler is None:
+            error_handlers = self.error_handlers
+            if self.debug or not error_handlers:
+                raise
+            handler = error_handlers.get(500)
+            if handler is None:
                 raise
             return handler(e)
 
@@ -483,9 +759,15 @@ class Flask(object):
         网络请求后的处理，保存请求的session，同时执行注册的回调函数
         将after_request_funcs内注册的回调函数依次执行
         用户可以通过after_request()方法注册回调函数到after_request_funcs中
+
+        默认的secure cookie在本次请求没有访问过时不会被修改，因此不需要保存，
+        子类重写了open_session()或save_session()时和之前一样总是加载并保存session
         """
-        session = _request_ctx_stack.top.session
-        if session is not None:
+        reqctx = _request_ctx_stack.top
+        session = reqctx._session
+        if session is _missing and self._custom_sessions:
+            session = reqctx.session
+        if session is not None and session is not _missing:
             self.save_session(session, response)
         for handler in self.after_request_funcs:
             response = handler(response)
@@ -495,20 +777,51 @@ class Flask(object):
         """
         实际处理网络请求，执行请求处理，并将返回值转换为Response类型。
         在执行前调用before_request_funcs内的回调函数， 在执行后执行after_request_funcs中的回调函数
-        """
-        with self.request_context(environ):
-            rv = self.preprocess_request()
-            if rv is None:
-                rv = self.dispatch_request()
-            response = self.make_response(rv)
-            response = self.process_response(response)
-            return response(environ, start_response)
+
+        静态文件的请求交给_static_app处理，其它请求不需要经过静态文件的中间件
+        """
+        static_app = self._static_app
+        if static_app is not None:
+            # 中间件会去掉路径中的空分段和'..'，这类路径也交给它判断是否为静态文件
+            path_info = environ.get('PATH_INFO', '')
+            if path_info.startswith(self._static_path) or \
+               '//' in path_info or '..' in path_info or \
+               not path_info.startswith('/'):
+                return static_app(environ, start_response)
+        return self._dispatch_wsgi(environ, start_response)
+
+    def _dispatch_wsgi(self, environ, start_response):
+        """Handles a request that is not served as static file."""
+        reqctx = self.request_context(environ)
+        with reqctx:
+            if self._custom_request_hooks or self.secret_key is not None or \
+               self.before_request_funcs or self.after_request_funcs:
+                rv = self.preprocess_request()
+                if rv is None:
+                    rv = self.dispatch_request()
+                response = self.make_response(rv)
+                response = self.process_response(response)
+            else:
+                # 没有注册回调函数也没有session时，请求前后的处理都可以跳过
+                response = self.make_response(self.dispatch_request())
+            app_iter = response(environ, start_response)
+        # 请求正常结束后回收上下文对象，出现异常时(debug模式下上下文仍在栈中)不回收
+        pool = self._ctx_pool
+        if len(pool) < self._ctx_pool_size:
+            reqctx._release()
+            pool.append(reqctx)
+        return app_iter
 
     def request_context(self, environ):
         """
-        创建请求上下文环境
+        创建请求上下文环境，优先复用_ctx_pool中已经结束的上下文对象
         """
-        return _RequestContext(self, environ)
+        try:
+            reqctx = self._ctx_pool.pop()
+        except IndexError:
+            return _RequestContext(self, environ)
+        reqctx._reinit(environ)
+        return reqctx
 
     def test_request_context(self, *args, **kwargs):
         """Creates a WSGI environment from the given values (see
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+    Flask Tests
+    ~~~~~~~~~~~
+
+    Tests Flask itself.  Run them with ``python tests/flask_tests.py``.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import flask
+from werkzeug.routing import Rule, BaseConverter
+from werkzeug.exceptions import HTTPException
+
+
+class SessionTestCase(unittest.TestCase):
+
+    def test_unused_session_not_loaded(self):
+        app = flask.Flask(__name__)
+        app.secret_key = 'testkey'
+        opened = []
+        @app.route('/')
+        def index():
+            opened.append(flask._request_ctx_stack.top._session)
+            return 'index'
+        assert app.test_client().get('/').data == 'index'
+        assert opened == [flask._missing]
+
+    def test_custom_session_saved_when_unused(self):
+        class CustomSessionFlask(flask.Flask):
+            def open_session(self, request):
+                return {'x': 1}
+            def save_session(self, session, response):
+                response.headers['X-Saved'] = str(session['x'])
+        app = CustomSessionFlask(__name__)
+        @app.route('/')
+        def index():
+            return 'index'
+        rv = app.test_client().get('/')
+        assert rv.data == 'index'
+        assert rv.headers.get('X-Saved') == '1'
+
+
+class StaticFilesTestCase(unittest.TestCase):
+
+    def test_static_files(self):
+        app = flask.Flask(__name__)
+        c = app.test_client()
+        for path in '/static/index.txt', '//static/index.txt', \
+                    '/../static/index.txt':
+            rv = c.get(path)
+            assert rv.status_code == 200, path
+            assert rv.data.strip() == 'static file', path
+        assert c.get('/static/missing.txt').status_code == 404
+
+    def test_static_path_falls_through(self):
+        app = flask.Flask(__name__)
+        @app.route('/static/dynamic')
+        def dynamic():
+            return 'dynamic'
+        assert app.test_client().get('/static/dynamic').data == 'dynamic'
+
+
+class URLTrieTestCase(unittest.TestCase):
+
+    segments = ['a', 'b', 'c', '<x>', '<string:y>', '<int:n>', '<path:p>']
+
+    def random_map(self, rnd):
+        url_map = flask._URLMap()
+        for idx in xrange(rnd.randint(1, 8)):
+            parts = []
+            for pos in xrange(rnd.randint(1, 3)):
+                part = rnd.choice(self.segments)
+                if part.startswith('<'):
+                    part = '%s%d>' % (part[:-1], pos)
+                parts.append(part)
+            rule = '/' + '/'.join(parts)
+            if rnd.random() < 0.3:
+                rule += '/'
+            if rnd.random() < 0.05:
+                rule = '/'
+            options = {}
+            if rnd.random() < 0.3:
+                options['methods'] = rnd.choice([['GET'], ['POST'],
+                                                 ['GET', 'POST']])
+            if rnd.random() < 0.05:
+                options['defaults'] = {'d': 1}
+            if rnd.random() < 0.05:
+                options['strict_slashes'] = False
+            url_map.add(Rule(rule, endpoint='e%d' % rnd.randint(0, 5),
+                             **options))
+        return url_map
+
+    def test_matches_like_werkzeug(self):
+        rnd = random.Random(42)
+        hits = 0
+        for trial in xrange(2000):
+            url_map = self.random_map(rnd)
+            trie = flask._URLTrie(url_map)
+            for attempt in xrange(10):
+                path = '/' + '/'.join(rnd.choice(['a', 'b', 'c', '5', ''])
+                                      for x in xrange(rnd.randint(0, 4)))
+                method = rnd.choice(['GET', 'POST', 'HEAD'])
+                adapter = url_map.bind('localhost', '/', default_method=method,
+                                       path_info=path)
+                rv = trie.match(adapter)
+                if rv is None:
+                    continue
+                hits += 1
+                try:
+                    expected = adapter.match()
+                except HTTPException, e:
+                    expected = e
+                self.assertEqual(rv, expected,
+                                 '%r %s %s' % (list(url_map.iter_rules()),
+                                               method, path))
+        assert hits > 500
+
+    def test_rules_added_to_map(self):
+        app = flask.Flask(__name__)
+        app.route('/<name>')(lambda name: 'variable')
+        app.view_functions['static_foo'] = lambda: 'static'
+        c = app.test_client()
+        assert c.get('/foo').data == 'variable'
+        app.url_map.add(Rule('/foo', endpoint='static_foo'))
+        assert c.get('/foo').data == 'static'
+
+    def test_replaced_converter(self):
+        class UpperConverter(BaseConverter):
+            def to_python(self, value):
+                return value.upper()
+        app = flask.Flask(__name__)
+        @app.route('/<name>')
+        def index(name):
+            return name
+        c = app.test_client()
+        assert c.get('/foo').data == 'foo'
+        app.url_map.converters['default'] = UpperConverter
+        @app.route('/<name>/x')
+        def upper(name):
+            return name
+        assert c.get('/foo').data == 'foo'
+        assert c.get('/foo/x').data == 'FOO'
+
+
+if __name__ == '__main__':
+    unittest.main()